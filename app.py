@@ -6,8 +6,12 @@ from openai import OpenAI
 import stripe
 import json
 import hashlib
+import base64
 from datetime import datetime
 from database import init_db, get_db, seed_data
+from assets import build_assets, asset_url, send_asset
+from orders import (create_pending_order, attach_customer, apply_payment_intent, get_order_status,
+                    ORDER_PENDING, ORDER_FAILED, ORDER_ABANDONED)
 
 app = Flask(__name__)
 
@@ -29,7 +33,10 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 openai_api_key = os.environ.get('OPENAI_API_KEY', '')
 openai_client = OpenAI(api_key=openai_api_key) if openai_api_key else None
 stripe.api_key = os.environ.get('STRIPE_SECRET_KEY', '')
+stripe_api_base = os.environ.get('STRIPE_API_BASE', 'https://api.stripe.com')
+stripe.api_base = stripe_api_base
 stripe_publishable_key = os.environ.get('STRIPE_PUBLISHABLE_KEY', 'pk_test_demo')
+stripe_webhook_secret = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
 
 import secrets
 
@@ -50,10 +57,172 @@ CSRF_SECRET = secrets.token_hex(32)
 
 init_db()
 seed_data()
+build_assets()
+
+app.jinja_env.globals['asset_url'] = asset_url
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def get_cart_summary(cart_items):
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    total = 0
+    product_ids = []
+    for item_id in cart_items:
+        cursor.execute('SELECT * FROM products WHERE id = ?', (item_id,))
+        product = cursor.fetchone()
+        if product:
+            total += product['price']
+            product_ids.append(product['id'])
+    
+    conn.close()
+    return total, product_ids
+
+def compute_cart_hash(product_ids):
+    return hashlib.sha256(json.dumps(sorted(product_ids)).encode()).hexdigest()
+
+def clear_checkout_session(payment_intent_id):
+    session['completed_payment_intent_id'] = payment_intent_id
+    session.pop('payment_intent_id', None)
+    session.pop('cart_hash', None)
+    session.pop('cart_total', None)
+    session['cart'] = []
+    session.modified = True
+
+CHAT_SYSTEM_PROMPT = "You are an expert in Ayurveda and AYUSH medicinal plants. Provide helpful, accurate information about medicinal plants, their uses, benefits, and traditional Ayurvedic practices. Be friendly and educational."
+
+RECOGNITION_PROMPT = "Identify this medicinal plant. If it's a medicinal plant used in Ayurveda or traditional medicine, provide its common name, scientific name, and key medicinal uses. If you're not certain, make your best guess from common medicinal plants."
+
+def chat_messages(user_message):
+    return [
+        {"role": "system", "content": CHAT_SYSTEM_PROMPT},
+        {"role": "user", "content": user_message}
+    ]
+
+def recognition_messages(image_data):
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": RECOGNITION_PROMPT},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{image_data}"
+                    }
+                }
+            ]
+        }
+    ]
+
+def save_upload_as_base64(file):
+    filename = secure_filename(file.filename)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    file.save(filepath)
+    
+    with open(filepath, 'rb') as img_file:
+        image_data = base64.b64encode(img_file.read()).decode('utf-8')
+    return filename, image_data
+
+# The API views below are split into prepare (validation, session, database) and finish
+# steps around the upstream OpenAI/Stripe call, so the sync views here and the async views
+# in asgi.py share everything except the transport. prepare_* returns (data, error_response).
+
+def prepare_chat():
+    data = request.json or {}
+    user_message = data.get('message', '')
+    
+    if not openai_api_key:
+        return None, jsonify({'response': 'AI chatbot is not configured. Please set the OPENAI_API_KEY environment variable.'})
+    
+    return user_message, None
+
+def chat_completion_args(user_message):
+    return {
+        'model': "gpt-3.5-turbo",
+        'messages': chat_messages(user_message),
+        'max_tokens': 500,
+        'temperature': 0.7
+    }
+
+def finish_chat(user_message, response):
+    bot_response = response.choices[0].message.content
+    log_analytics('chatbot_query', {'query': user_message[:100]})
+    
+    return jsonify({'response': bot_response})
+
+def prepare_recognition():
+    if 'image' not in request.files:
+        return None, (jsonify({'error': 'No image provided'}), 400)
+    
+    file = request.files['image']
+    if not file.filename or file.filename == '':
+        return None, (jsonify({'error': 'No image selected'}), 400)
+    
+    if not allowed_file(file.filename):
+        return None, (jsonify({'error': 'Invalid file type'}), 400)
+    
+    if not openai_api_key:
+        return None, (jsonify({'error': 'AI recognition is not configured. Please set the OPENAI_API_KEY environment variable.'}), 400)
+    
+    return save_upload_as_base64(file), None
+
+def recognition_completion_args(image_data):
+    return {
+        'model': "gpt-4o",
+        'messages': recognition_messages(image_data),
+        'max_tokens': 300
+    }
+
+def finish_recognition(filename, response):
+    result = response.choices[0].message.content
+    log_analytics('plant_recognition', {'filename': filename})
+    
+    return jsonify({'result': result})
+
+def prepare_payment_intent():
+    cart_items = session.get('cart', [])
+    if not cart_items:
+        return None, (jsonify({'error': 'Cart is empty'}), 400)
+    
+    if not stripe.api_key:
+        return None, (jsonify({'error': 'Payment processing is not configured'}), 400)
+    
+    total, product_ids = get_cart_summary(cart_items)
+    
+    if total <= 0:
+        return None, (jsonify({'error': 'Invalid cart total'}), 400)
+    
+    cart = {
+        'items': cart_items,
+        'total': total,
+        'product_ids': product_ids,
+        'cart_hash': compute_cart_hash(product_ids)
+    }
+    return cart, None
+
+def payment_intent_params(cart):
+    return {
+        'amount': int(cart['total'] * 100),
+        'currency': 'usd',
+        'metadata': {
+            'cart_hash': cart['cart_hash'],
+            'product_count': len(cart['product_ids'])
+        }
+    }
+
+def finish_payment_intent(cart, payment_intent_id, client_secret):
+    create_pending_order(payment_intent_id, cart['items'], cart['total'], cart['cart_hash'])
+    
+    session['payment_intent_id'] = payment_intent_id
+    session['cart_hash'] = cart['cart_hash']
+    session['cart_total'] = cart['total']
+    session.modified = True
+    
+    return jsonify({'clientSecret': client_secret})
+
 def check_admin_auth():
     auth = request.authorization
     if not auth or auth.username != ADMIN_USERNAME or auth.password != ADMIN_PASSWORD:
@@ -73,6 +242,10 @@ def generate_csrf_token():
 def verify_csrf_token(token):
     return token and session.get('csrf_token') == token
 
+@app.route('/assets/<path:filename>')
+def assets(filename):
+    return send_asset(filename)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -160,46 +333,13 @@ def checkout():
 @app.route('/api/create-payment-intent', methods=['POST'])
 def create_payment_intent():
     try:
-        cart_items = session.get('cart', [])
-        if not cart_items:
-            return jsonify({'error': 'Cart is empty'}), 400
+        cart, error = prepare_payment_intent()
+        if error:
+            return error
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        total = 0
-        product_ids = []
-        for item_id in cart_items:
-            cursor.execute('SELECT * FROM products WHERE id = ?', (item_id,))
-            product = cursor.fetchone()
-            if product:
-                total += product['price']
-                product_ids.append(product['id'])
-        
-        conn.close()
-        
-        if total <= 0:
-            return jsonify({'error': 'Invalid cart total'}), 400
-        
-        amount = int(total * 100)
+        intent = stripe.PaymentIntent.create(**payment_intent_params(cart))
         
-        cart_hash = hashlib.sha256(json.dumps(sorted(product_ids)).encode()).hexdigest()
-        
-        intent = stripe.PaymentIntent.create(
-            amount=amount,
-            currency='usd',
-            metadata={
-                'cart_hash': cart_hash,
-                'product_count': len(product_ids)
-            }
-        )
-        
-        session['payment_intent_id'] = intent.id
-        session['cart_hash'] = cart_hash
-        session['cart_total'] = total
-        session.modified = True
-        
-        return jsonify({'clientSecret': intent.client_secret})
+        return finish_payment_intent(cart, intent.id, intent.client_secret)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
@@ -213,75 +353,56 @@ def complete_order():
         if not payment_intent_id:
             return jsonify({'error': 'Payment verification required'}), 400
         
+        if payment_intent_id == session.get('completed_payment_intent_id'):
+            return jsonify({'success': True, 'status': get_order_status(payment_intent_id)})
+        
         if payment_intent_id != session.get('payment_intent_id'):
             return jsonify({'error': 'Invalid payment intent'}), 400
         
         if not cart_items:
             return jsonify({'error': 'Cart is empty'}), 400
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        server_total = 0
-        product_ids = []
-        for item_id in cart_items:
-            cursor.execute('SELECT * FROM products WHERE id = ?', (item_id,))
-            product = cursor.fetchone()
-            if product:
-                server_total += product['price']
-                product_ids.append(product['id'])
-        
-        cart_hash = hashlib.sha256(json.dumps(sorted(product_ids)).encode()).hexdigest()
+        _, product_ids = get_cart_summary(cart_items)
+        cart_hash = compute_cart_hash(product_ids)
         
         if cart_hash != session.get('cart_hash'):
-            conn.close()
             return jsonify({'error': 'Cart has been modified'}), 400
         
-        if stripe.api_key and payment_intent_id.startswith('pi_'):
-            try:
-                payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
-                
-                if payment_intent.status != 'succeeded':
-                    conn.close()
-                    return jsonify({'error': 'Payment not completed'}), 400
-                
-                expected_amount = int(server_total * 100)
-                if payment_intent.amount != expected_amount:
-                    conn.close()
-                    return jsonify({'error': 'Payment amount mismatch'}), 400
-                
-                if payment_intent.metadata.get('cart_hash') != cart_hash:
-                    conn.close()
-                    return jsonify({'error': 'Cart verification failed'}), 400
-                    
-            except stripe.error.StripeError as e:
-                conn.close()
-                return jsonify({'error': f'Payment verification failed: {str(e)}'}), 400
-        else:
-            conn.close()
-            return jsonify({'error': 'Payment processing is not configured'}), 400
+        # The order row was written ahead in create_payment_intent; payment is confirmed
+        # by the Stripe webhook (or reconcile.py), so nothing here waits on Stripe.
+        order_status = attach_customer(payment_intent_id, cart_hash, data.get('name', ''), data.get('email', ''))
+        if not order_status:
+            return jsonify({'error': 'Invalid payment intent'}), 400
         
-        cursor.execute('''
-            INSERT INTO orders (customer_name, customer_email, total_amount, items, stripe_payment_id, status)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (data.get('name', ''), data.get('email', ''), server_total, json.dumps(cart_items), 
-              payment_intent_id, 'completed'))
+        if order_status == ORDER_FAILED:
+            return jsonify({'error': 'Payment verification failed'}), 400
         
-        conn.commit()
-        conn.close()
+        clear_checkout_session(payment_intent_id)
         
-        session.pop('payment_intent_id', None)
-        session.pop('cart_hash', None)
-        session.pop('cart_total', None)
-        session['cart'] = []
-        session.modified = True
-        
-        log_analytics('order_completed', {'amount': server_total, 'items_count': len(cart_items)})
-        
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'status': order_status})
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/api/stripe-webhook', methods=['POST'])
+def stripe_webhook():
+    if not stripe_webhook_secret:
+        return jsonify({'error': 'Webhook secret is not configured'}), 400
+    
+    payload = request.get_data(as_text=True)
+    try:
+        stripe.WebhookSignature.verify_header(payload, request.headers.get('Stripe-Signature', ''),
+                                              stripe_webhook_secret, tolerance=stripe.Webhook.DEFAULT_TOLERANCE)
+        event = json.loads(payload)
+    except (ValueError, stripe.error.SignatureVerificationError):
+        return jsonify({'error': 'Invalid webhook signature'}), 400
+    
+    if event.get('type') in ('payment_intent.succeeded', 'payment_intent.canceled'):
+        intent = event['data']['object']
+        apply_payment_intent(intent['id'], intent['status'], intent['amount'],
+                             (intent.get('metadata') or {}).get('cart_hash'))
+    
+    return jsonify({'received': True})
+
 @app.route('/chatbot')
 def chatbot():
     return render_template('chatbot.html')
@@ -289,26 +410,13 @@ def chatbot():
 @app.route('/api/chat', methods=['POST'])
 def chat():
     try:
-        data = request.json or {}
-        user_message = data.get('message', '')
-        
-        if not openai_client:
-            return jsonify({'response': 'AI chatbot is not configured. Please set the OPENAI_API_KEY environment variable.'})
+        user_message, error = prepare_chat()
+        if error:
+            return error
         
-        response = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an expert in Ayurveda and AYUSH medicinal plants. Provide helpful, accurate information about medicinal plants, their uses, benefits, and traditional Ayurvedic practices. Be friendly and educational."},
-                {"role": "user", "content": user_message}
-            ],
-            max_tokens=500,
-            temperature=0.7
-        )
+        response = openai_client.chat.completions.create(**chat_completion_args(user_message))
         
-        bot_response = response.choices[0].message.content
-        log_analytics('chatbot_query', {'query': user_message[:100]})
-        
-        return jsonify({'response': bot_response})
+        return finish_chat(user_message, response)
     except Exception as e:
         return jsonify({'response': f'Sorry, I encountered an error: {str(e)}'})
 
@@ -319,50 +427,14 @@ def recognize():
 @app.route('/api/recognize-plant', methods=['POST'])
 def recognize_plant():
     try:
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image provided'}), 400
-        
-        file = request.files['image']
-        if not file.filename or file.filename == '':
-            return jsonify({'error': 'No image selected'}), 400
-        
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Invalid file type'}), 400
-        
-        if not openai_client:
-            return jsonify({'error': 'AI recognition is not configured. Please set the OPENAI_API_KEY environment variable.'}), 400
-        
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        upload, error = prepare_recognition()
+        if error:
+            return error
         
-        import base64
-        with open(filepath, 'rb') as img_file:
-            image_data = base64.b64encode(img_file.read()).decode('utf-8')
+        filename, image_data = upload
+        response = openai_client.chat.completions.create(**recognition_completion_args(image_data))
         
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Identify this medicinal plant. If it's a medicinal plant used in Ayurveda or traditional medicine, provide its common name, scientific name, and key medicinal uses. If you're not certain, make your best guess from common medicinal plants."},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_data}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=300
-        )
-        
-        result = response.choices[0].message.content
-        log_analytics('plant_recognition', {'filename': filename})
-        
-        return jsonify({'result': result})
+        return finish_recognition(filename, response)
     except Exception as e:
         return jsonify({'error': f'Recognition failed: {str(e)}'}), 400
 
@@ -432,7 +504,12 @@ def admin():
     cursor.execute('SELECT * FROM community_submissions WHERE status = "pending" ORDER BY created_at DESC')
     pending_submissions = cursor.fetchall()
     
-    cursor.execute('SELECT * FROM orders ORDER BY created_at DESC LIMIT 10')
+    # Skip write-ahead rows for checkouts that were opened but never submitted or paid
+    cursor.execute('''
+        SELECT * FROM orders
+        WHERE status != ? AND NOT (status = ? AND customer_email = '')
+        ORDER BY created_at DESC LIMIT 10
+    ''', (ORDER_ABANDONED, ORDER_PENDING))
     recent_orders = cursor.fetchall()
     
     conn.close()
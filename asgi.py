@@ -0,0 +1,187 @@
+import asyncio
+import io
+import sys
+
+import httpx
+import stripe
+from flask import Response, jsonify
+from openai import AsyncOpenAI
+
+from app import (app, openai_api_key, stripe_api_base, prepare_chat, chat_completion_args, finish_chat,
+                 prepare_recognition, recognition_completion_args, finish_recognition,
+                 prepare_payment_intent, payment_intent_params, finish_payment_intent)
+from database import run_db
+
+# Async serving mode: run with `uvicorn asgi:application`.
+# The upstream-bound API routes below are served natively on the event loop so a single
+# process can hold many in-flight OpenAI/Stripe calls; every other route (including the
+# Stripe webhook and complete-order, which only touch the database) is passed through to
+# the regular Flask app. Validation, session and database work is shared with the sync
+# views in app.py and runs in a worker thread; only the upstream call is awaited here.
+
+async_openai_client = AsyncOpenAI(api_key=openai_api_key) if openai_api_key else None
+stripe_http = httpx.AsyncClient(
+    base_url=stripe_api_base,
+    timeout=30.0,
+    limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+)
+
+class StripeAPIError(Exception):
+    pass
+
+def stripe_form(params):
+    # Stripe takes nested parameters as form fields like metadata[cart_hash]
+    form = {}
+    for key, value in params.items():
+        if isinstance(value, dict):
+            form.update({f'{key}[{name}]': item for name, item in value.items()})
+        else:
+            form[key] = value
+    return form
+
+async def stripe_request(method, path, **kwargs):
+    response = await stripe_http.request(method, path, auth=(stripe.api_key, ''), **kwargs)
+    payload = response.json()
+    if response.is_error:
+        raise StripeAPIError(payload.get('error', {}).get('message', f'Stripe returned {response.status_code}'))
+    return payload
+
+async def chat():
+    try:
+        user_message, error = prepare_chat()
+        if error:
+            return error
+
+        response = await async_openai_client.chat.completions.create(**chat_completion_args(user_message))
+
+        return await run_db(finish_chat, user_message, response)
+    except Exception as e:
+        return jsonify({'response': f'Sorry, I encountered an error: {str(e)}'})
+
+async def recognize_plant():
+    try:
+        upload, error = await run_db(prepare_recognition)
+        if error:
+            return error
+
+        filename, image_data = upload
+        response = await async_openai_client.chat.completions.create(**recognition_completion_args(image_data))
+
+        return await run_db(finish_recognition, filename, response)
+    except Exception as e:
+        return jsonify({'error': f'Recognition failed: {str(e)}'}), 400
+
+async def create_payment_intent():
+    try:
+        cart, error = await run_db(prepare_payment_intent)
+        if error:
+            return error
+
+        intent = await stripe_request('POST', '/v1/payment_intents', data=stripe_form(payment_intent_params(cart)))
+
+        return await run_db(finish_payment_intent, cart, intent['id'], intent['client_secret'])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+ASYNC_VIEWS = {
+    ('POST', '/api/chat'): chat,
+    ('POST', '/api/recognize-plant'): recognize_plant,
+    ('POST', '/api/create-payment-intent'): create_payment_intent,
+}
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+def build_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            key = name
+        else:
+            key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+async def send_response(response, send):
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin1'), value.encode('latin1'))
+                    for name, value in response.headers.items()]
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+async def dispatch_async_view(view, scope, receive, send):
+    body = await read_body(receive)
+    if body is None:
+        return
+
+    # Reuse Flask's request parsing, session cookie and after_request hooks (CORS);
+    # the request context lives in contextvars, so it is private to this task.
+    environ = build_environ(scope, body)
+    with app.request_context(environ):
+        rv = app.preprocess_request()
+        if rv is None:
+            rv = await view()
+        response = app.process_response(app.make_response(rv))
+
+    await send_response(response, send)
+
+async def dispatch_wsgi(scope, receive, send):
+    body = await read_body(receive)
+    if body is None:
+        return
+
+    # Run the plain Flask app on a worker thread and buffer its response. (asgiref's
+    # WsgiToAsgi was used here before, but its thread-sensitive executor state leaks
+    # between keep-alive requests and fails concurrent requests with a RuntimeError.)
+    response = await asyncio.to_thread(Response.from_app, app, build_environ(scope, body), buffered=True)
+    await send_response(response, send)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await stripe_http.aclose()
+            if async_openai_client:
+                await async_openai_client.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    if scope['type'] == 'http':
+        view = ASYNC_VIEWS.get((scope['method'], scope['path']))
+        if view:
+            return await dispatch_async_view(view, scope, receive, send)
+        return await dispatch_wsgi(scope, receive, send)
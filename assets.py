@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import gzip
+import hashlib
+import mimetypes
+from flask import request, send_file, url_for, abort
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image, features
+    if not features.check('webp'):
+        Image = None
+except ImportError:
+    Image = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+BUILD_DIR = os.path.join(BASE_DIR, 'build', 'assets')
+MANIFEST_PATH = os.path.join(BUILD_DIR, 'manifest.json')
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html'}
+WEBP_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+VARIANT_SUFFIXES = ('.gz', '.br', '.webp')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+manifest = {}
+
+def fingerprint_name(relative_path, content):
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    stem, ext = os.path.splitext(relative_path)
+    return f'{stem}.{digest}{ext}'
+
+def write_if_missing(path, content):
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def build_variants(source_path, output_path, content, previous_skipped, skipped):
+    # A variant that didn't save bytes is recorded in the manifest instead of written,
+    # so it isn't rebuilt on every start.
+    ext = os.path.splitext(source_path)[1].lower()
+    encoders = []
+    if ext in COMPRESSIBLE_EXTENSIONS:
+        encoders.append(('.gz', lambda: gzip.compress(content, compresslevel=9, mtime=0)))
+        if brotli:
+            encoders.append(('.br', lambda: brotli.compress(content, quality=11)))
+
+    for suffix, compress in encoders:
+        variant = os.path.relpath(output_path + suffix, BUILD_DIR).replace(os.sep, '/')
+        if variant in previous_skipped:
+            skipped.add(variant)
+        elif not os.path.exists(output_path + suffix):
+            compressed = compress()
+            if len(compressed) < len(content):
+                write_if_missing(output_path + suffix, compressed)
+            else:
+                skipped.add(variant)
+
+    variant = os.path.relpath(output_path + '.webp', BUILD_DIR).replace(os.sep, '/')
+    if ext not in WEBP_EXTENSIONS or not Image or os.path.exists(output_path + '.webp'):
+        return
+    if variant in previous_skipped:
+        skipped.add(variant)
+        return
+
+    tmp_path = f'{output_path}.webp.tmp{os.getpid()}'
+    try:
+        with Image.open(source_path) as img:
+            img.save(tmp_path, 'WEBP', quality=82, method=6)
+        if os.path.getsize(tmp_path) < len(content):
+            os.replace(tmp_path, output_path + '.webp')
+        else:
+            skipped.add(variant)
+    except (OSError, KeyError, ValueError):
+        # Unreadable image or Pillow without a WebP encoder: serve the original only
+        skipped.add(variant)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def read_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Manifests written before skipped variants were recorded are a flat source -> hashed map
+    return data if 'assets' in data else {'assets': data}
+
+def build_assets():
+    previous_skipped = set(read_manifest().get('skipped_variants', []))
+    new_manifest = {}
+    skipped = set()
+    for root, dirs, files in os.walk(STATIC_DIR):
+        for name in files:
+            source_path = os.path.join(root, name)
+            relative_path = os.path.relpath(source_path, STATIC_DIR).replace(os.sep, '/')
+
+            with open(source_path, 'rb') as f:
+                content = f.read()
+
+            hashed_path = fingerprint_name(relative_path, content)
+            output_path = os.path.join(BUILD_DIR, hashed_path)
+            write_if_missing(output_path, content)
+            build_variants(source_path, output_path, content, previous_skipped, skipped)
+            new_manifest[relative_path] = hashed_path
+
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    tmp_path = f'{MANIFEST_PATH}.tmp{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump({'assets': new_manifest, 'skipped_variants': sorted(skipped)}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+    manifest.clear()
+    manifest.update(new_manifest)
+    return manifest
+
+def prune_assets():
+    # Old fingerprints stay servable after a deploy (cached pages may still reference
+    # them) until this removes everything the current manifest no longer points at.
+    keep = {'manifest.json'}
+    for hashed_path in manifest.values():
+        keep.add(hashed_path)
+        keep.update(hashed_path + suffix for suffix in VARIANT_SUFFIXES)
+
+    removed = []
+    for root, dirs, files in os.walk(BUILD_DIR, topdown=False):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.relpath(path, BUILD_DIR).replace(os.sep, '/') not in keep:
+                os.remove(path)
+                removed.append(path)
+        if root != BUILD_DIR and not os.listdir(root):
+            os.rmdir(root)
+    return removed
+
+def asset_url(filename, **values):
+    hashed_path = manifest.get(filename)
+    if hashed_path:
+        return url_for('assets', filename=hashed_path, **values)
+    return url_for('static', filename=filename, **values)
+
+def send_asset(filename):
+    path = safe_join(BUILD_DIR, filename)
+    if not path or filename == 'manifest.json' or '.tmp' in os.path.basename(filename) or not os.path.isfile(path):
+        abort(404)
+
+    # Encoded variants are only reachable through negotiation on the original URL
+    for suffix in VARIANT_SUFFIXES:
+        if filename.endswith(suffix) and os.path.isfile(path[:-len(suffix)]):
+            abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    served_path = path
+    content_encoding = None
+    vary = 'Accept-Encoding'
+
+    if os.path.splitext(filename)[1].lower() in WEBP_EXTENSIONS:
+        vary = 'Accept'
+        if 'image/webp' in request.headers.get('Accept', '') and os.path.isfile(path + '.webp'):
+            served_path = path + '.webp'
+            mimetype = 'image/webp'
+    else:
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+                served_path = path + suffix
+                content_encoding = encoding
+                break
+
+    response = send_file(served_path, mimetype=mimetype, conditional=True)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.headers['Vary'] = vary
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    return response
+
+if __name__ == '__main__':
+    build_assets()
+    removed = prune_assets()
+    for source, hashed in sorted(manifest.items()):
+        print(f'{source} -> {hashed}')
+    print(f'Wrote {len(manifest)} assets to {BUILD_DIR}, pruned {len(removed)} stale files', file=sys.stderr)
@@ -0,0 +1,274 @@
+"""Compare sync (WSGI) and async (ASGI) serving modes on an upstream-bound route.
+
+Both modes are pointed at a local stand-in for the OpenAI API that answers every
+chat completion after a fixed delay, so the numbers reflect how many upstream
+calls each mode can keep in flight rather than real model latency.
+
+The sync baseline is gunicorn with a fixed pool (--workers x --threads gthread
+workers); the async mode is uvicorn with the same number of workers. Both get
+the same keep-alive timeout, and the load comes from separate generator
+processes that use the same connection policy against either mode (persistent
+connections by default, or a new connection per request with --no-keep-alive).
+CPU seconds used by the server processes and by the load generators during the
+run are reported alongside, so a saturated generator shows up in the results.
+
+    python benchmark.py --requests 1000 --concurrency 200 --latency 0.5
+    python benchmark.py --workers 2 --threads 16 --load-processes 2 --no-keep-alive
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+UPSTREAM_LATENCY = float(os.environ.get('BENCH_UPSTREAM_LATENCY', '0.5'))
+KEEP_ALIVE_TIMEOUT = 5
+CHAT_BODY = json.dumps({'message': 'What is Tulsi good for?'}).encode()
+
+async def upstream_stub(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    while (await receive()).get('more_body'):
+        pass
+    await asyncio.sleep(UPSTREAM_LATENCY)
+    body = json.dumps({
+        'id': 'chatcmpl-bench',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': 'gpt-3.5-turbo',
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': 'Tulsi supports immunity.'},
+            'finish_reason': 'stop'
+        }],
+        'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+    }).encode()
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+# Load generator. Runs in its own process (python benchmark.py --load-worker URL) and speaks
+# plain HTTP/1.1 over asyncio streams: one task per connection, each sending its share of the
+# requests back to back, like wrk does.
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers, body
+
+def is_chat_reply(status, body):
+    if status != 200:
+        return False
+    reply = json.loads(body).get('response', '')
+    return 'error' not in reply and 'not configured' not in reply
+
+async def connection_worker(host, port, path, count, keep_alive, latencies, errors):
+    request = (f'POST {path} HTTP/1.1\r\n'
+               f'Host: {host}:{port}\r\n'
+               'Content-Type: application/json\r\n'
+               f'Content-Length: {len(CHAT_BODY)}\r\n'
+               f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + CHAT_BODY
+    reader = writer = None
+    for _ in range(count):
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            status, headers, body = await asyncio.wait_for(read_response(reader), 120)
+            if not is_chat_reply(status, body):
+                errors.append(status)
+            if not keep_alive or headers.get('connection', '').lower() == 'close':
+                writer.close()
+                writer = None
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            errors.append(None)
+            if writer:
+                writer.close()
+            writer = None
+        latencies.append(time.perf_counter() - started)
+    if writer:
+        writer.close()
+
+async def generate_load(url, total_requests, concurrency, keep_alive):
+    target = httpx.URL(url)
+    latencies = []
+    errors = []
+    per_connection, remainder = divmod(total_requests, concurrency)
+    counts = [per_connection + (1 if i < remainder else 0) for i in range(concurrency)]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connection_worker(target.host, target.port, target.path, count,
+                                             keep_alive, latencies, errors)
+                           for count in counts if count))
+    elapsed = time.perf_counter() - started
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'elapsed': elapsed,
+        'latencies': latencies,
+        'errors': len(errors),
+        'cpu': usage.ru_utime + usage.ru_stime
+    }
+
+def run_load(url, options):
+    processes = min(options.load_processes, options.concurrency)
+    commands = []
+    for i in range(processes):
+        requests = options.requests // processes + (1 if i < options.requests % processes else 0)
+        concurrency = options.concurrency // processes + (1 if i < options.concurrency % processes else 0)
+        commands.append([sys.executable, os.path.abspath(__file__), '--load-worker', url,
+                         '--requests', str(requests), '--concurrency', str(concurrency)]
+                        + ([] if options.keep_alive else ['--no-keep-alive']))
+
+    workers = [subprocess.Popen(command, stdout=subprocess.PIPE) for command in commands]
+    reports = [json.loads(worker.communicate()[0]) for worker in workers]
+
+    latencies = sorted(latency for report in reports for latency in report['latencies'])
+    elapsed = max(report['elapsed'] for report in reports)
+    return {
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1],
+        'errors': sum(report['errors'] for report in reports),
+        'loadgen_cpu': sum(report['cpu'] for report in reports)
+    }
+
+def process_tree_cpu(pid):
+    # User + system CPU seconds of pid and all its descendants (server workers), from /proc
+    if not os.path.isdir('/proc'):
+        return None
+    ticks = os.sysconf('SC_CLK_TCK')
+    children = {}
+    cpu = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        cpu[int(entry)] = (int(fields[11]) + int(fields[12])) / ticks
+
+    total = 0.0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        total += cpu.get(current, 0.0)
+        stack.extend(children.get(current, []))
+    return total
+
+def start_server(args, env, cwd):
+    return subprocess.Popen(args, env=env, cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server at {url} did not start')
+
+def benchmark(options):
+    env = dict(os.environ,
+               PYTHONPATH=REPO_DIR,
+               BENCH_UPSTREAM_LATENCY=str(options.latency),
+               OPENAI_API_KEY='sk-bench',
+               OPENAI_BASE_URL=f'http://127.0.0.1:{options.port}/v1',
+               SESSION_SECRET='bench',
+               ADMIN_USERNAME='bench',
+               ADMIN_PASSWORD='bench')
+
+    modes = {
+        'sync': [sys.executable, '-m', 'gunicorn', 'app:app',
+                 '--bind', f'127.0.0.1:{options.port + 1}',
+                 '--worker-class', 'gthread',
+                 '--workers', str(options.workers),
+                 '--threads', str(options.threads),
+                 '--keep-alive', str(KEEP_ALIVE_TIMEOUT),
+                 '--log-level', 'warning'],
+        'async': [sys.executable, '-m', 'uvicorn', 'asgi:application',
+                  '--port', str(options.port + 2),
+                  '--workers', str(options.workers),
+                  '--timeout-keep-alive', str(KEEP_ALIVE_TIMEOUT),
+                  '--log-level', 'warning'],
+    }
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        upstream = start_server([sys.executable, '-m', 'uvicorn', 'benchmark:upstream_stub',
+                                 '--port', str(options.port), '--log-level', 'warning'], env, workdir)
+        try:
+            wait_until_ready(f'http://127.0.0.1:{options.port}/')
+            for offset, (mode, args) in enumerate(modes.items(), start=1):
+                base_url = f'http://127.0.0.1:{options.port + offset}'
+                server = start_server(args, env, workdir)
+                try:
+                    wait_until_ready(base_url + '/')
+                    cpu_before = process_tree_cpu(server.pid)
+                    results[mode] = run_load(base_url + '/api/chat', options)
+                    cpu_after = process_tree_cpu(server.pid)
+                    results[mode]['server_cpu'] = None if cpu_before is None else cpu_after - cpu_before
+                finally:
+                    server.terminate()
+                    server.wait()
+        finally:
+            upstream.terminate()
+            upstream.wait()
+
+    print(f'{options.requests} requests to /api/chat, concurrency {options.concurrency}, '
+          f'upstream latency {options.latency}s, '
+          f"{'keep-alive' if options.keep_alive else 'new connection per request'}")
+    print(f'{options.workers} worker(s) per mode (sync: {options.threads} threads each), '
+          f'{min(options.load_processes, options.concurrency)} load generator process(es), '
+          f'{os.cpu_count()} CPU(s)')
+    print(f"{'mode':<8}{'elapsed':>10}{'req/s':>10}{'p50':>10}{'p95':>10}{'errors':>8}"
+          f"{'server cpu':>12}{'loadgen cpu':>13}")
+    for mode, result in results.items():
+        server_cpu = 'n/a' if result['server_cpu'] is None else f"{result['server_cpu']:.2f}s"
+        print(f"{mode:<8}{result['elapsed']:>9.2f}s{result['throughput']:>10.1f}"
+              f"{result['p50']:>9.3f}s{result['p95']:>9.3f}s{result['errors']:>8}"
+              f"{server_cpu:>12}{result['loadgen_cpu']:>12.2f}s")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.5, help='simulated upstream latency in seconds')
+    parser.add_argument('--workers', type=int, default=1, help='server worker processes in each mode')
+    parser.add_argument('--threads', type=int, default=32, help='threads per gunicorn worker in sync mode')
+    parser.add_argument('--load-processes', type=int, default=1, help='load generator processes')
+    parser.add_argument('--no-keep-alive', dest='keep_alive', action='store_false',
+                        help='open a new connection for every request in both modes')
+    parser.add_argument('--port', type=int, default=5100, help='base port; the servers use port..port+2')
+    parser.add_argument('--load-worker', metavar='URL', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.load_worker:
+        report = asyncio.run(generate_load(options.load_worker, options.requests,
+                                           options.concurrency, options.keep_alive))
+        print(json.dumps(report))
+    else:
+        benchmark(options)
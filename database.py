@@ -1,4 +1,5 @@
 import sqlite3
+import asyncio
 from datetime import datetime
 import json
 
@@ -9,10 +10,19 @@ def get_db():
     conn.row_factory = sqlite3.Row
     return conn
 
+async def run_db(func, *args, **kwargs):
+    # sqlite3 calls block, so the async serving mode runs them on a worker thread.
+    # func must open its own connection with get_db(); connections are not shared across threads.
+    # to_thread copies the contextvars, so func still sees the current Flask request and session.
+    return await asyncio.to_thread(func, *args, **kwargs)
+
 def init_db():
     conn = get_db()
     cursor = conn.cursor()
     
+    # WAL lets readers proceed while the async mode has several writers in flight
+    cursor.execute('PRAGMA journal_mode=WAL')
+    
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS plants (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -50,11 +60,39 @@ def init_db():
             total_amount REAL NOT NULL,
             items TEXT,
             stripe_payment_id TEXT,
+            cart_hash TEXT,
+            duplicate_of INTEGER,
             status TEXT DEFAULT 'pending',
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
     
+    cursor.execute('PRAGMA table_info(orders)')
+    columns = [column['name'] for column in cursor.fetchall()]
+    if 'cart_hash' not in columns:
+        cursor.execute('ALTER TABLE orders ADD COLUMN cart_hash TEXT')
+    if 'duplicate_of' not in columns:
+        cursor.execute('ALTER TABLE orders ADD COLUMN duplicate_of INTEGER')
+    
+    # Idempotency key for the order pipeline: one order per Stripe PaymentIntent.
+    # Older versions could record the same payment twice. Before the index first exists, keep
+    # the extra rows but move them out of the key: status 'duplicate', pointing at the earliest row.
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_orders_stripe_payment_id'")
+    if not cursor.fetchone():
+        cursor.execute('''
+            UPDATE orders
+            SET status = 'duplicate',
+                duplicate_of = (SELECT MIN(first.id) FROM orders AS first
+                                WHERE first.stripe_payment_id = orders.stripe_payment_id),
+                stripe_payment_id = NULL
+            WHERE stripe_payment_id IS NOT NULL AND id NOT IN (
+                SELECT MIN(id) FROM orders WHERE stripe_payment_id IS NOT NULL GROUP BY stripe_payment_id
+            )
+        ''')
+        if cursor.rowcount > 0:
+            print(f"WARNING: marked {cursor.rowcount} orders sharing a stripe_payment_id as 'duplicate' (kept the earliest).")
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_stripe_payment_id ON orders (stripe_payment_id)')
+    
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS community_submissions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
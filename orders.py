@@ -0,0 +1,119 @@
+import json
+from database import get_db
+
+# Order lifecycle, keyed by the Stripe PaymentIntent id (unique index on orders.stripe_payment_id):
+#   pending   - written ahead when the PaymentIntent is created
+#   completed - Stripe reported the intent succeeded and amount/cart matched
+#   failed    - the intent was canceled, or succeeded with a mismatched amount/cart
+#   abandoned - the reconciler found the intent still unpaid after its abandon window
+#   duplicate - a legacy row for an already-recorded payment, moved out of the key by init_db
+# Transitions only ever leave 'pending' (or 'abandoned', if the customer pays late), so webhook
+# retries, the reconciler and client retries can all race without completing an order twice.
+ORDER_PENDING = 'pending'
+ORDER_COMPLETED = 'completed'
+ORDER_FAILED = 'failed'
+ORDER_ABANDONED = 'abandoned'
+ORDER_DUPLICATE = 'duplicate'
+OPEN_STATUSES = (ORDER_PENDING, ORDER_ABANDONED)
+
+def check_payment_intent(status, amount, intent_cart_hash, server_total, cart_hash):
+    if status != 'succeeded':
+        return 'Payment not completed'
+
+    expected_amount = int(server_total * 100)
+    if amount != expected_amount:
+        return 'Payment amount mismatch'
+
+    if intent_cart_hash != cart_hash:
+        return 'Cart verification failed'
+
+    return None
+
+def create_pending_order(payment_intent_id, cart_items, total, cart_hash):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO orders (customer_name, customer_email, total_amount, items, stripe_payment_id, cart_hash, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (stripe_payment_id) DO NOTHING
+    ''', ('', '', total, json.dumps(cart_items), payment_intent_id, cart_hash, ORDER_PENDING))
+    conn.commit()
+    conn.close()
+
+def attach_customer(payment_intent_id, cart_hash, name, email):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE orders SET customer_name = ?, customer_email = ?
+        WHERE stripe_payment_id = ? AND cart_hash = ?
+    ''', (name, email, payment_intent_id, cart_hash))
+    conn.commit()
+
+    cursor.execute('SELECT status FROM orders WHERE stripe_payment_id = ? AND cart_hash = ?',
+                   (payment_intent_id, cart_hash))
+    order = cursor.fetchone()
+    conn.close()
+    return order['status'] if order else None
+
+def get_order_status(payment_intent_id):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT status FROM orders WHERE stripe_payment_id = ?', (payment_intent_id,))
+    order = cursor.fetchone()
+    conn.close()
+    return order['status'] if order else None
+
+def apply_payment_intent(payment_intent_id, status, amount, intent_cart_hash):
+    if status not in ('succeeded', 'canceled'):
+        # processing / requires_action / requires_payment_method: the customer may still pay
+        return None
+
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM orders WHERE stripe_payment_id = ?', (payment_intent_id,))
+    order = cursor.fetchone()
+    if not order or order['status'] not in OPEN_STATUSES:
+        conn.close()
+        return None
+
+    if status == 'succeeded':
+        verification_error = check_payment_intent(status, amount, intent_cart_hash,
+                                                  order['total_amount'], order['cart_hash'])
+        new_status = ORDER_FAILED if verification_error else ORDER_COMPLETED
+    else:
+        new_status = ORDER_FAILED
+
+    cursor.execute('UPDATE orders SET status = ? WHERE stripe_payment_id = ? AND status = ?',
+                   (new_status, payment_intent_id, order['status']))
+    if cursor.rowcount != 1:
+        conn.close()
+        return None
+
+    if new_status == ORDER_COMPLETED:
+        # Logged in the same transaction so the event is recorded exactly once as well
+        cursor.execute('INSERT INTO analytics (event_type, event_data) VALUES (?, ?)',
+                       ('order_completed', json.dumps({'amount': order['total_amount'],
+                                                       'items_count': len(json.loads(order['items']))})))
+
+    conn.commit()
+    conn.close()
+    return new_status
+
+def abandon_order(payment_intent_id):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('UPDATE orders SET status = ? WHERE stripe_payment_id = ? AND status = ?',
+                   (ORDER_ABANDONED, payment_intent_id, ORDER_PENDING))
+    abandoned = cursor.rowcount == 1
+    conn.commit()
+    conn.close()
+    return ORDER_ABANDONED if abandoned else None
+
+def get_pending_orders():
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, stripe_payment_id, created_at FROM orders WHERE status = ? ORDER BY id',
+                   (ORDER_PENDING,))
+    orders = cursor.fetchall()
+    conn.close()
+    return orders
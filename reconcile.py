@@ -0,0 +1,94 @@
+"""Settle pending orders whose Stripe webhook never arrived.
+
+Pending orders are verified in a single pass: one PaymentIntent list
+(100 intents per page) walks every intent created since the oldest pending
+order in the last --max-age-hours once, instead of one retrieve per order.
+Older orders (say, after the reconciler was down) and any the list doesn't
+return are retrieved one by one instead. Outcomes go through the same
+idempotent transition as the webhook, so running this alongside it is safe.
+Orders still unpaid after --abandon-after-hours are marked abandoned so they
+stop being checked; a late payment still completes them via the webhook.
+
+    python reconcile.py            # run once
+    python reconcile.py --loop     # keep running every --interval seconds
+"""
+import os
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+import stripe
+from database import init_db
+from orders import get_pending_orders, apply_payment_intent, abandon_order
+
+stripe.api_key = os.environ.get('STRIPE_SECRET_KEY', '')
+stripe.api_base = os.environ.get('STRIPE_API_BASE', 'https://api.stripe.com')
+
+def parse_created_at(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+def settle(intent_id, intent, created_at, abandon_before):
+    status = None
+    if intent:
+        status = apply_payment_intent(intent.id, intent.status, intent.amount,
+                                      getattr(intent.metadata, 'cart_hash', None))
+    if not status and (not intent or intent.status != 'processing') and created_at < abandon_before:
+        status = abandon_order(intent_id)
+    return status
+
+def reconcile_pending_orders(max_age_hours=48, abandon_after_hours=24):
+    now = datetime.now(timezone.utc)
+    list_after = now - timedelta(hours=max_age_hours)
+    abandon_before = now - timedelta(hours=abandon_after_hours)
+
+    pending_ids = {order['stripe_payment_id']: parse_created_at(order['created_at'])
+                   for order in get_pending_orders()}
+    recent_ids = {intent_id: created_at for intent_id, created_at in pending_ids.items()
+                  if created_at >= list_after}
+
+    results = {}
+    if recent_ids:
+        # Allow for clock skew between Stripe and the database
+        oldest = min(recent_ids.values())
+        intents = stripe.PaymentIntent.list(created={'gte': int(oldest.timestamp()) - 300}, limit=100)
+        for intent in intents.auto_paging_iter():
+            created_at = recent_ids.pop(intent.id, None)
+            if created_at is None:
+                continue
+            results[intent.id] = settle(intent.id, intent, created_at, abandon_before)
+            if not recent_ids:
+                break
+
+    for intent_id, created_at in pending_ids.items():
+        if intent_id in results:
+            continue
+        try:
+            intent = stripe.PaymentIntent.retrieve(intent_id)
+        except stripe.error.InvalidRequestError:
+            # Unknown to Stripe, so it can never be paid
+            intent = None
+        results[intent_id] = settle(intent_id, intent, created_at, abandon_before)
+
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-age-hours', type=int, default=48, help='retrieve pending orders older than this one by one instead of listing them')
+    parser.add_argument('--abandon-after-hours', type=int, default=24,
+                        help='mark still-unpaid orders older than this as abandoned')
+    parser.add_argument('--loop', action='store_true')
+    parser.add_argument('--interval', type=int, default=60, help='seconds between runs with --loop')
+    options = parser.parse_args()
+
+    if not stripe.api_key:
+        raise SystemExit('STRIPE_SECRET_KEY is not set')
+
+    init_db()
+    while True:
+        results = reconcile_pending_orders(options.max_age_hours, options.abandon_after_hours)
+        settled = {intent_id: status for intent_id, status in results.items() if status}
+        print(f'Checked {len(results)} pending orders, settled {len(settled)}')
+        for intent_id, status in settled.items():
+            print(f'  {intent_id}: {status}')
+        if not options.loop:
+            break
+        time.sleep(options.interval)
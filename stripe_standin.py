@@ -0,0 +1,166 @@
+"""Local stand-in for the parts of the Stripe API the order pipeline uses.
+
+Keeps PaymentIntents in memory and delivers signed webhook events, so the
+checkout, webhook and reconciler paths can run without network access:
+
+    flask --app stripe_standin run --port 12111
+    STRIPE_API_BASE=http://127.0.0.1:12111 STRIPE_SECRET_KEY=sk_test_local \\
+        STRIPE_WEBHOOK_SECRET=whsec_local python app.py
+
+Confirm or cancel an intent the way the browser would through Stripe.js:
+
+    curl -u sk_test_local: -X POST http://127.0.0.1:12111/v1/payment_intents/<id>/confirm
+    curl -u sk_test_local: -X POST http://127.0.0.1:12111/v1/payment_intents/<id>/cancel
+
+STANDIN_WEBHOOK_URL (default http://127.0.0.1:5000/api/stripe-webhook) and
+STANDIN_WEBHOOK_SECRET (default whsec_local) control webhook delivery; set
+STANDIN_WEBHOOK_URL to an empty string to drop events and exercise reconcile.py.
+"""
+import os
+import hmac
+import json
+import time
+import hashlib
+import secrets
+import threading
+import httpx
+from flask import Flask, request, jsonify
+
+app = Flask(__name__)
+
+WEBHOOK_URL = os.environ.get('STANDIN_WEBHOOK_URL', 'http://127.0.0.1:5000/api/stripe-webhook')
+WEBHOOK_SECRET = os.environ.get('STANDIN_WEBHOOK_SECRET', 'whsec_local')
+WEBHOOK_DELAY = float(os.environ.get('STANDIN_WEBHOOK_DELAY', '0.5'))
+
+payment_intents = {}
+lock = threading.Lock()
+
+def stripe_error(message, status=400, error_type='invalid_request_error'):
+    return jsonify({'error': {'type': error_type, 'message': message}}), status
+
+def sign_payload(payload, timestamp):
+    signed = f'{timestamp}.{payload}'.encode()
+    return hmac.new(WEBHOOK_SECRET.encode(), signed, hashlib.sha256).hexdigest()
+
+def signature_header(payload, timestamp=None):
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    return f't={timestamp},v1={sign_payload(payload, timestamp)}'
+
+def event_payload(event_type, intent):
+    return json.dumps({
+        'id': 'evt_' + secrets.token_hex(12),
+        'object': 'event',
+        'type': event_type,
+        'created': int(time.time()),
+        'data': {'object': intent}
+    })
+
+def deliver_webhook(event_type, intent):
+    if not WEBHOOK_URL:
+        return
+    payload = event_payload(event_type, intent)
+
+    def send():
+        time.sleep(WEBHOOK_DELAY)
+        try:
+            httpx.post(WEBHOOK_URL, content=payload, headers={
+                'Content-Type': 'application/json',
+                'Stripe-Signature': signature_header(payload)
+            }, timeout=10)
+        except httpx.HTTPError as e:
+            print(f'Webhook delivery failed: {e}')
+
+    threading.Thread(target=send, daemon=True).start()
+
+@app.before_request
+def require_api_key():
+    if not request.authorization:
+        return stripe_error('You did not provide an API key.', 401, 'authentication_error')
+
+@app.route('/v1/payment_intents', methods=['POST'])
+def create_payment_intent():
+    form = request.form
+    try:
+        amount = int(form['amount'])
+    except (KeyError, ValueError):
+        return stripe_error('Missing required param: amount.')
+
+    intent_id = 'pi_' + secrets.token_hex(12)
+    intent = {
+        'id': intent_id,
+        'object': 'payment_intent',
+        'amount': amount,
+        'currency': form.get('currency', 'usd'),
+        'status': 'requires_payment_method',
+        'client_secret': f'{intent_id}_secret_{secrets.token_hex(12)}',
+        'created': int(time.time()),
+        'metadata': {key[len('metadata['):-1]: value for key, value in form.items()
+                     if key.startswith('metadata[') and key.endswith(']')}
+    }
+    with lock:
+        payment_intents[intent_id] = intent
+    return jsonify(intent)
+
+@app.route('/v1/payment_intents', methods=['GET'])
+def list_payment_intents():
+    limit = min(int(request.args.get('limit', 10)), 100)
+    created_gte = int(request.args.get('created[gte]', 0))
+    starting_after = request.args.get('starting_after')
+
+    with lock:
+        intents = sorted(payment_intents.values(), key=lambda intent: intent['created'], reverse=True)
+    intents = [intent for intent in intents if intent['created'] >= created_gte]
+
+    if starting_after:
+        ids = [intent['id'] for intent in intents]
+        intents = intents[ids.index(starting_after) + 1:] if starting_after in ids else []
+
+    return jsonify({
+        'object': 'list',
+        'url': '/v1/payment_intents',
+        'data': intents[:limit],
+        'has_more': len(intents) > limit
+    })
+
+@app.route('/v1/payment_intents/<intent_id>', methods=['GET'])
+def retrieve_payment_intent(intent_id):
+    intent = payment_intents.get(intent_id)
+    if not intent:
+        return stripe_error(f"No such payment_intent: '{intent_id}'", 404)
+    return jsonify(intent)
+
+@app.route('/v1/payment_intents/<intent_id>/confirm', methods=['POST'])
+def confirm_payment_intent(intent_id):
+    with lock:
+        intent = payment_intents.get(intent_id)
+        if not intent:
+            return stripe_error(f"No such payment_intent: '{intent_id}'", 404)
+        if intent['status'] in ('succeeded', 'canceled'):
+            return stripe_error(f"This PaymentIntent's status is {intent['status']}.")
+
+        if request.form.get('payment_method') == 'pm_card_chargeDeclined':
+            event_type = 'payment_intent.payment_failed'
+        else:
+            intent['status'] = 'succeeded'
+            event_type = 'payment_intent.succeeded'
+        intent = dict(intent)
+
+    deliver_webhook(event_type, intent)
+    return jsonify(intent)
+
+@app.route('/v1/payment_intents/<intent_id>/cancel', methods=['POST'])
+def cancel_payment_intent(intent_id):
+    with lock:
+        intent = payment_intents.get(intent_id)
+        if not intent:
+            return stripe_error(f"No such payment_intent: '{intent_id}'", 404)
+        if intent['status'] == 'succeeded':
+            return stripe_error("This PaymentIntent's status is succeeded.")
+        intent['status'] = 'canceled'
+        intent = dict(intent)
+
+    deliver_webhook('payment_intent.canceled', intent)
+    return jsonify(intent)
+
+if __name__ == '__main__':
+    app.run(host='127.0.0.1', port=12111)
@@ -0,0 +1,28 @@
+import threading
+
+import pytest
+import stripe
+from werkzeug.serving import make_server
+
+import database
+import stripe_standin
+
+
+@pytest.fixture
+def stripe_api(monkeypatch):
+    monkeypatch.setattr(stripe_standin, 'WEBHOOK_URL', '')
+    stripe_standin.payment_intents.clear()
+    server = make_server('127.0.0.1', 0, stripe_standin.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(stripe, 'api_key', 'sk_test_local')
+    monkeypatch.setattr(stripe, 'api_base', f'http://127.0.0.1:{server.server_port}')
+    yield
+    server.shutdown()
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DATABASE', str(tmp_path / 'test.db'))
+    database.init_db()
+    return database.get_db
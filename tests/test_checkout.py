@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+import stripe
+
+import database
+import orders
+import stripe_standin
+
+
+@pytest.fixture
+def app_module(db):
+    # Imported here so its start-up init_db/seed_data run against the test database
+    import app
+    database.seed_data()
+    return app
+
+
+@pytest.fixture
+def client(app_module, stripe_api, monkeypatch):
+    # Requested after app_module: importing app resets stripe.api_key/api_base from the environment
+    monkeypatch.setattr(app_module, 'stripe_webhook_secret', stripe_standin.WEBHOOK_SECRET)
+    return app_module.app.test_client()
+
+
+def start_checkout(client, product_ids=(1, 2)):
+    for product_id in product_ids:
+        client.post('/api/cart', json={'product_id': product_id, 'action': 'add'})
+    response = client.post('/api/create-payment-intent')
+    assert response.status_code == 200
+    return response.get_json()['clientSecret'].split('_secret_')[0]
+
+
+def confirm(intent_id):
+    stripe_standin.payment_intents[intent_id]['status'] = 'succeeded'
+
+
+def complete_order(client, intent_id):
+    return client.post('/api/complete-order', json={'payment_intent_id': intent_id,
+                                                    'name': 'Asha', 'email': 'asha@example.com'})
+
+
+def send_webhook(client, intent_id, event_type='payment_intent.succeeded', signature=None):
+    payload = stripe_standin.event_payload(event_type, stripe_standin.payment_intents[intent_id])
+    return client.post('/api/stripe-webhook', data=payload, content_type='application/json',
+                       headers={'Stripe-Signature': signature or stripe_standin.signature_header(payload)})
+
+
+def completed_events(get_db):
+    conn = get_db()
+    count = conn.execute("SELECT COUNT(*) FROM analytics WHERE event_type = 'order_completed'").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_duplicate_webhooks_complete_the_order_once(client, app_module, db):
+    intent_id = start_checkout(client)
+    confirm(intent_id)
+    assert complete_order(client, intent_id).get_json() == {'success': True, 'status': orders.ORDER_PENDING}
+
+    statuses = []
+
+    def deliver():
+        statuses.append(send_webhook(app_module.app.test_client(), intent_id).status_code)
+
+    threads = [threading.Thread(target=deliver) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    statuses.append(send_webhook(client, intent_id).status_code)
+
+    assert statuses == [200] * 9
+    assert orders.get_order_status(intent_id) == orders.ORDER_COMPLETED
+    assert completed_events(db) == 1
+
+
+def test_webhook_rejects_bad_and_stale_signatures(client, app_module, db, monkeypatch):
+    intent_id = start_checkout(client)
+    confirm(intent_id)
+    payload = stripe_standin.event_payload('payment_intent.succeeded', stripe_standin.payment_intents[intent_id])
+
+    stale = int(time.time()) - stripe.Webhook.DEFAULT_TOLERANCE - 60
+    forged = stripe_standin.signature_header(payload).replace('v1=', 'v1=0')
+    for signature in (forged, stripe_standin.signature_header(payload, stale), 't=1'):
+        assert send_webhook(client, intent_id, signature=signature).status_code == 400
+
+    monkeypatch.setattr(stripe_standin, 'WEBHOOK_SECRET', 'whsec_other')
+    assert send_webhook(client, intent_id).status_code == 400
+
+    monkeypatch.setattr(app_module, 'stripe_webhook_secret', '')
+    assert send_webhook(client, intent_id).status_code == 400
+
+    assert orders.get_order_status(intent_id) == orders.ORDER_PENDING
+    assert completed_events(db) == 0
+
+
+def test_complete_order_retry_reports_the_same_order(client, db):
+    intent_id = start_checkout(client)
+    confirm(intent_id)
+
+    assert complete_order(client, intent_id).get_json() == {'success': True, 'status': orders.ORDER_PENDING}
+    assert client.post('/api/cart', json={'action': 'get'}).get_json()['cart'] == []
+
+    # The session no longer holds the intent or cart, so only completed_payment_intent_id matches
+    assert complete_order(client, intent_id).get_json() == {'success': True, 'status': orders.ORDER_PENDING}
+    assert send_webhook(client, intent_id).status_code == 200
+    assert complete_order(client, intent_id).get_json() == {'success': True, 'status': orders.ORDER_COMPLETED}
+
+    assert complete_order(client, 'pi_other').status_code == 400
+    conn = db()
+    assert conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0] == 1
+    conn.close()
+    assert completed_events(db) == 1
@@ -0,0 +1,60 @@
+import database
+import orders
+
+
+def legacy_orders_db(tmp_path, monkeypatch, payment_ids):
+    # The orders table as it was before cart_hash and the unique index existed
+    monkeypatch.setattr(database, 'DATABASE', str(tmp_path / 'legacy.db'))
+    conn = database.get_db()
+    conn.execute('''
+        CREATE TABLE orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_name TEXT NOT NULL,
+            customer_email TEXT NOT NULL,
+            total_amount REAL NOT NULL,
+            items TEXT,
+            stripe_payment_id TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany('''
+        INSERT INTO orders (customer_name, customer_email, total_amount, items, stripe_payment_id, status)
+        VALUES ('Asha', 'asha@example.com', 24.99, '[1]', ?, 'completed')
+    ''', [(payment_id,) for payment_id in payment_ids])
+    conn.commit()
+    conn.close()
+
+
+def all_orders():
+    conn = database.get_db()
+    rows = [tuple(row) for row in
+            conn.execute('SELECT id, stripe_payment_id, status, duplicate_of FROM orders ORDER BY id')]
+    conn.close()
+    return rows
+
+
+def test_init_db_keeps_legacy_duplicates_out_of_the_unique_key(tmp_path, monkeypatch):
+    legacy_orders_db(tmp_path, monkeypatch, ['pi_a', 'pi_a', 'pi_b', 'pi_a', None, None])
+
+    database.init_db()
+
+    expected = [
+        (1, 'pi_a', orders.ORDER_COMPLETED, None),
+        (2, None, orders.ORDER_DUPLICATE, 1),
+        (3, 'pi_b', orders.ORDER_COMPLETED, None),
+        (4, None, orders.ORDER_DUPLICATE, 1),
+        (5, None, orders.ORDER_COMPLETED, None),
+        (6, None, orders.ORDER_COMPLETED, None),
+    ]
+    assert all_orders() == expected
+
+    # One-time migration: later starts leave the table alone
+    database.init_db()
+    assert all_orders() == expected
+
+    # The unique index now backs create_pending_order's idempotency
+    orders.create_pending_order('pi_a', [1], 24.99, 'cart')
+    orders.create_pending_order('pi_c', [1], 24.99, 'cart')
+    orders.create_pending_order('pi_c', [1], 24.99, 'cart')
+    assert [row[1] for row in all_orders()[6:]] == ['pi_c']
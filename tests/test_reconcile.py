@@ -0,0 +1,91 @@
+import stripe
+
+import orders
+import reconcile
+import stripe_standin
+
+
+def checkout(total=24.99, cart_hash='cart'):
+    intent = stripe.PaymentIntent.create(amount=int(total * 100), currency='usd',
+                                         metadata={'cart_hash': cart_hash})
+    orders.create_pending_order(intent.id, [1], total, cart_hash)
+    return intent.id
+
+
+def confirm(intent_id):
+    stripe_standin.payment_intents[intent_id]['status'] = 'succeeded'
+
+
+def backdate(get_db, intent_ids, hours):
+    conn = get_db()
+    conn.executemany("UPDATE orders SET created_at = datetime('now', ?) WHERE stripe_payment_id = ?",
+                     [(f'-{hours} hours', intent_id) for intent_id in intent_ids])
+    conn.commit()
+    conn.close()
+
+
+def test_paid_order_is_settled_alongside_abandoned_checkouts(stripe_api, db):
+    abandoned = [checkout() for _ in range(120)]
+    backdate(db, abandoned, 30)
+    paid = checkout()
+    confirm(paid)
+
+    results = reconcile.reconcile_pending_orders()
+
+    assert results[paid] == orders.ORDER_COMPLETED
+    assert orders.get_order_status(paid) == orders.ORDER_COMPLETED
+    assert {orders.get_order_status(intent_id) for intent_id in abandoned} == {orders.ORDER_ABANDONED}
+    assert reconcile.reconcile_pending_orders() == {}
+
+
+def test_recent_unpaid_checkouts_stay_pending_and_do_not_block_paid_orders(stripe_api, db):
+    unpaid = [checkout() for _ in range(120)]
+    paid = checkout()
+    confirm(paid)
+
+    reconcile.reconcile_pending_orders()
+
+    assert orders.get_order_status(paid) == orders.ORDER_COMPLETED
+    assert {orders.get_order_status(intent_id) for intent_id in unpaid} == {orders.ORDER_PENDING}
+
+
+def test_pending_orders_are_checked_in_one_pass_over_the_intent_list(stripe_api, db, monkeypatch):
+    intent_ids = [checkout() for _ in range(250)]
+    for intent_id in intent_ids[::2]:
+        confirm(intent_id)
+
+    list_calls = []
+    list_view = stripe_standin.app.view_functions['list_payment_intents']
+    monkeypatch.setitem(stripe_standin.app.view_functions, 'list_payment_intents',
+                        lambda: list_calls.append(1) or list_view())
+
+    results = reconcile.reconcile_pending_orders()
+
+    assert len(results) == 250
+    assert sum(status == orders.ORDER_COMPLETED for status in results.values()) == 125
+    assert len(list_calls) == 3
+
+
+def test_orders_older_than_the_list_window_are_still_settled(stripe_api, db):
+    paid = checkout()
+    confirm(paid)
+    unpaid = checkout()
+    unknown = 'pi_missing'
+    orders.create_pending_order(unknown, [1], 24.99, 'cart')
+    backdate(db, [paid, unpaid, unknown], 72)
+
+    results = reconcile.reconcile_pending_orders(max_age_hours=48)
+
+    assert results == {paid: orders.ORDER_COMPLETED, unpaid: orders.ORDER_ABANDONED,
+                       unknown: orders.ORDER_ABANDONED}
+    assert reconcile.reconcile_pending_orders(max_age_hours=48) == {}
+
+
+def test_late_payment_completes_an_abandoned_order(stripe_api, db):
+    intent_id = checkout()
+    backdate(db, [intent_id], 30)
+    reconcile.reconcile_pending_orders()
+    assert orders.get_order_status(intent_id) == orders.ORDER_ABANDONED
+
+    assert orders.apply_payment_intent(intent_id, 'succeeded', 2499, 'cart') == orders.ORDER_COMPLETED
+    assert orders.apply_payment_intent(intent_id, 'succeeded', 2499, 'cart') is None